@@ -4,10 +4,30 @@ Batch STL Generator for Model Train Tracks (R24-R120)
 Generates optimized files for smaller 3D printers
 """
 
-import subprocess
+import asyncio
+import functools
+import os
 import sys
 from pathlib import Path
 
+from generate_stls import (
+    CONFIGURATIONS,
+    QUALITY_PRESETS,
+    RENDER_SPAWN_KWARGS,
+    RENDER_TIMEOUT,
+    begin_render,
+    check_openscad,
+    clear_meta,
+    finish_render,
+    generate_scad_params,
+)
+
+# Track design rendered for every radius
+SCAD_FILE = Path(__file__).parent / "curves.scad"
+
+# Configurations rendered for every radius, as shown in help and dry runs
+CONFIG_LABEL = ", ".join(CONFIGURATIONS.keys())
+
 # Standard radius range (in studs)
 RADII = [24, 32, 40, 48, 56, 64, 72, 80, 88, 96, 104, 112, 120]
 
@@ -32,7 +52,14 @@ ANGLE_MAP = {
 
 # Diverse settings: parametric curve
 # V-shaped with minimum at R64 (500), peaks at R24 and R104+ (1800)
-# Uses quadratic formula centered at R64
+# Uses quadratic formula centered at R64: diverse = a * (radius - 64)^2 + 500
+# Where a = 0.8125 to hit 1800 at radius 24 and 104
+DIVERSE_SLOPE = 0.8125
+DIVERSE_VERTEX = 64
+DIVERSE_MIN = 500
+DIVERSE_MAX = 1800
+
+@functools.lru_cache(maxsize=256)
 def calculate_diverse(radius):
     """
     Parametric diverse calculation:
@@ -40,66 +67,86 @@ def calculate_diverse(radius):
     - Peaks at R24 and R104+: 1800
     - Caps at 1800 for large radii
     """
-    # Quadratic: diverse = a * (radius - 64)^2 + 500
-    # Where a = 0.8125 to hit 1800 at radius 24 and 104
-    a = 0.8125
-    vertex = 64
-    minimum = 500
-    maximum = 1800
-    
-    diverse = a * (radius - vertex) ** 2 + minimum
-    return min(int(diverse), maximum)
+    diverse = DIVERSE_SLOPE * (radius - DIVERSE_VERTEX) ** 2 + DIVERSE_MIN
+    return min(int(diverse), DIVERSE_MAX)
 
 # Generate the diverse map using the parametric function
 DIVERSE_MAP = {radius: calculate_diverse(radius) for radius in RADII}
 
-def run_generator(radius: int, angle: float, diverse: int, output_dir: Path = None, verbose: bool = False):
-    """Run the STL generator for a specific radius"""
-    cmd = [
-        "python3",
-        "generate_stls.py",
-        "-r", str(radius),
-        "-a", str(angle),
-        "-d", str(diverse),
-    ]
-    
-    if output_dir:
-        cmd.extend(["-o", str(output_dir)])
+async def run_openscad(cmd: list) -> tuple:
+    """Run a single openscad render without blocking the event loop, returning (returncode, stderr)"""
+    proc = await asyncio.create_subprocess_exec(*cmd, **RENDER_SPAWN_KWARGS)
     
-    if verbose:
-        cmd.append("-v")
+    try:
+        _, stderr = await asyncio.wait_for(proc.communicate(), RENDER_TIMEOUT)
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        # Never leave openscad running once its render is abandoned
+        try:
+            proc.kill()
+        except ProcessLookupError:
+            pass
+        await proc.wait()
+        raise
     
-    if verbose:
-        print(f"\n{'='*70}")
-        print(f"Generating R{radius}: angle={angle}°, diverse={diverse}")
-        print(f"{'='*70}")
-    else:
-        print(f"Generating R{radius}... ", end="", flush=True)
+    return proc.returncode, stderr.decode(errors="replace")
+
+
+async def render_job(
+    semaphore: asyncio.Semaphore,
+    job: tuple,
+    output_dir: Path,
+    verbose: bool = False,
+    force: bool = False,
+    quality: str = "final"
+) -> bool:
+    """Render a single (radius, angle, diverse, config) job to an STL file"""
+    radius, angle, diverse, config = job
+    output_file = output_dir / f"r{radius}_{config}.stl"
     
+    # Any failure is contained to this STL so the rest of the batch carries on
     try:
-        result = subprocess.run(
-            cmd,
-            capture_output=not verbose,
-            text=True,
-            timeout=600  # 10 minute timeout
-        )
-        
-        if result.returncode == 0:
-            print("✓" if not verbose else "")
+        params = generate_scad_params(radius, angle, config, diverse, quality)
+        cmd = begin_render(SCAD_FILE, output_file, params, force)
+        if cmd is None:
+            print(f"{output_file.name} ✓ (up to date)")
             return True
-        else:
-            print("✗" if not verbose else "")
-            print(f"Error: {result.stderr}", file=sys.stderr)
-            return False
-    
-    except subprocess.TimeoutExpired:
-        print("✗ (timeout)" if not verbose else "")
-        print(f"Error: Timeout for R{radius}", file=sys.stderr)
-        return False
+        
+        # The semaphore caps how many openscad processes run at once
+        async with semaphore:
+            if verbose:
+                print(f"Generating: {output_file.name}")
+                print(f"Command: {' '.join(cmd)}")
+            
+            clear_meta(output_file)
+            returncode, stderr = await run_openscad(cmd)
+        
+        success = finish_render(SCAD_FILE, output_file, params, returncode, stderr)
+    
+    except asyncio.TimeoutError:
+        print(f"Error: Timeout generating {output_file.name}", file=sys.stderr)
+        success = False
     except Exception as e:
-        print("✗ (error)" if not verbose else "")
-        print(f"Error generating R{radius}: {e}", file=sys.stderr)
-        return False
+        print(f"Error generating {output_file.name}: {e}", file=sys.stderr)
+        success = False
+    
+    print(f"{output_file.name} {'✓' if success else '✗'}")
+    return success
+
+
+async def render_all(
+    jobs: list,
+    output_dir: Path,
+    max_jobs: int,
+    verbose: bool = False,
+    force: bool = False,
+    quality: str = "final"
+) -> list:
+    """Render every job from one event loop, returning a success flag per job"""
+    semaphore = asyncio.Semaphore(max(1, max_jobs))
+    return await asyncio.gather(*[
+        render_job(semaphore, job, output_dir, verbose, force, quality)
+        for job in jobs
+    ])
 
 
 def main():
@@ -107,11 +154,11 @@ def main():
     
     parser = argparse.ArgumentParser(
         description="Batch generate track STLs from R24 to R120",
-        epilog="""
+        epilog=f"""
 Generates optimized files for smaller 3D printers with:
 - Variable angles: larger angles for small radii, smaller for large radii
 - Optimized diverse: balanced sleeper density for each radius
-- All 4 configurations per radius: ballast_and_buddy, ballast, track_ballast_and_buddy, track_and_ballast
+- All {len(CONFIGURATIONS)} configurations per radius: {CONFIG_LABEL}
 
 Example: python3 batch_generate.py -v
         """
@@ -128,6 +175,23 @@ Example: python3 batch_generate.py -v
         default=Path.cwd(),
         help="Output directory (default: current directory)"
     )
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Maximum number of STLs to render in parallel (default: CPU count)"
+    )
+    parser.add_argument(
+        "-q", "--quality",
+        choices=list(QUALITY_PRESETS.keys()),
+        default="final",
+        help="Curve smoothness: preview and print render faster than final (default: final)"
+    )
+    parser.add_argument(
+        "-f", "--force",
+        action="store_true",
+        help="Regenerate STL files even if they are up to date"
+    )
     parser.add_argument(
         "--dry-run",
         action="store_true",
@@ -143,41 +207,57 @@ Example: python3 batch_generate.py -v
         for radius in RADII:
             angle = ANGLE_MAP[radius]
             diverse = DIVERSE_MAP[radius]
-            configs = "ballast_and_buddy, ballast, track_ballast_and_buddy, track_and_ballast"
-            print(f"R{radius:<9} {angle:<10.2f} {diverse:<10} {configs}")
-        print(f"\nTotal: {len(RADII)} radii × 4 configs = {len(RADII) * 4} STL files")
+            print(f"R{radius:<9} {angle:<10.2f} {diverse:<10} {CONFIG_LABEL}")
+        print(f"\nTotal: {len(RADII)} radii × {len(CONFIGURATIONS)} configs = "
+              f"{len(RADII) * len(CONFIGURATIONS)} STL files")
         return
     
+    if not SCAD_FILE.exists():
+        print(f"Error: SCAD file not found: {SCAD_FILE}", file=sys.stderr)
+        sys.exit(1)
+    
+    check_openscad()
+    
+    output_dir = args.output_dir.resolve()
+    
     print(f"Batch generating track STLs (R24-R120)")
-    print(f"Output directory: {args.output_dir.resolve()}")
+    print(f"Output directory: {output_dir}")
     print(f"Total radii: {len(RADII)}")
-    print(f"Total files: {len(RADII) * 4}\n")
+    print(f"Total files: {len(RADII) * len(CONFIGURATIONS)}")
+    print(f"Parallel jobs: {args.jobs}\n")
     
-    success_count = 0
-    failed_radii = []
+    args.output_dir.mkdir(parents=True, exist_ok=True)
     
-    for radius in RADII:
-        angle = ANGLE_MAP[radius]
-        diverse = DIVERSE_MAP[radius]
-        
-        if run_generator(radius, angle, diverse, args.output_dir, args.verbose):
-            success_count += 1
-        else:
-            failed_radii.append(radius)
+    # Every (radius, config) pair is an independent render, so queue them all
+    # up front: a slow radius never holds back the configs of later radii
+    jobs = [
+        (radius, ANGLE_MAP[radius], DIVERSE_MAP[radius], config)
+        for radius in RADII
+        for config in CONFIGURATIONS
+    ]
+    
+    # One event loop drives all renders; a new openscad process starts as soon
+    # as any running one exits, so -j processes stay busy until the queue drains
+    results = asyncio.run(
+        render_all(jobs, args.output_dir, args.jobs, args.verbose, args.force, args.quality)
+    )
+    
+    successful_files = sum(results)
+    failed_radii = {job[0] for job, success in zip(jobs, results) if not success}
     
     # Summary
-    total_files = len(RADII) * 4
-    successful_files = success_count * 4
+    total_files = len(jobs)
+    success_count = len(RADII) - len(failed_radii)
     
     print(f"\n{'='*70}")
     print(f"Batch Generation Complete")
     print(f"{'='*70}")
     print(f"Radii processed: {success_count}/{len(RADII)}")
     print(f"Files generated: {successful_files}/{total_files}")
-    print(f"Output directory: {args.output_dir.resolve()}")
+    print(f"Output directory: {output_dir}")
     
     if failed_radii:
-        print(f"\nFailed radii: {', '.join([f'R{r}' for r in failed_radii])}")
+        print(f"\nFailed radii: {', '.join([f'R{r}' for r in sorted(failed_radii)])}")
         sys.exit(1)
     else:
         print("All files generated successfully! ✓")
@@ -6,9 +6,14 @@ Programmatically generates STL files for different track configurations
 
 import subprocess
 import argparse
+import hashlib
+import json
+import os
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 import shutil
 
 # Define the available configurations
@@ -35,39 +40,194 @@ CONFIGURATIONS = {
     },
 }
 
+# Render quality presets: extra OpenSCAD definitions overriding curves.scad's
+# curve_detail (facets per mm of curve radius, 9 by default). Facet count
+# dominates render time, so lower presets are much faster for iteration.
+QUALITY_PRESETS = {
+    "preview": ["-D", "curve_detail=0.5"],
+    "print": ["-D", "curve_detail=2"],
+    "final": [],
+}
+
+# Maximum time allowed for a single STL render, in seconds
+RENDER_TIMEOUT = 300
+
+# Launch settings shared by every openscad render. The STL goes to the -o file,
+# so only stderr is kept for error reports. Keeping close_fds off lets CPython
+# launch openscad with posix_spawn instead of fork+exec; Python creates
+# descriptors non-inheritable anyway.
+RENDER_SPAWN_KWARGS = {
+    "stdout": subprocess.DEVNULL,
+    "stderr": subprocess.PIPE,
+    "close_fds": False,
+}
+
+# Serializes output from configurations rendered on concurrent threads
+PRINT_LOCK = threading.Lock()
+
+# Absolute path to the openscad executable, resolved once at import
+OPENSCAD_BIN = shutil.which("openscad")
+
+# Extra command-line flags selecting the fastest CSG backend, set by check_openscad()
+OPENSCAD_FLAGS: List[str] = []
+
+def detect_openscad_flags() -> List[str]:
+    """Return the flags enabling the fastest CSG backend the installed OpenSCAD supports"""
+    try:
+        result = subprocess.run(
+            [OPENSCAD_BIN, "--help"],
+            capture_output=True,
+            text=True,
+            timeout=30,
+            close_fds=False  # Allows posix_spawn, see RENDER_SPAWN_KWARGS
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return []
+    
+    # Help text goes to stderr on some builds
+    help_text = result.stdout + result.stderr
+    
+    if "--backend" in help_text:
+        # Newer builds select Manifold with a dedicated option
+        return ["--backend=Manifold"]
+    if "manifold" in help_text:
+        # 2023 development snapshots ship it as an experimental feature
+        return ["--enable=manifold"]
+    if "fast-csg" in help_text:
+        return ["--enable=fast-csg"]
+    return []
+
+
 def check_openscad():
     """Check if OpenSCAD is installed and available"""
-    result = subprocess.run(
-        ["which", "openscad"],
-        capture_output=True,
-        text=True
-    )
-    if result.returncode != 0:
+    global OPENSCAD_FLAGS
+    
+    if OPENSCAD_BIN is None:
         print("Error: OpenSCAD is not installed or not in PATH", file=sys.stderr)
         print("Please install OpenSCAD from https://openscad.org/", file=sys.stderr)
         sys.exit(1)
+    
+    OPENSCAD_FLAGS = detect_openscad_flags()
 
 
-def generate_scad_params(radius: int, angle: float, config: str, diverse: int = None) -> str:
-    """Generate OpenSCAD parameters for the given configuration"""
+def generate_scad_params(
+    radius: int,
+    angle: float,
+    config: str,
+    diverse: int = None,
+    quality: str = "final"
+) -> List[str]:
+    """Generate OpenSCAD -D arguments for the given configuration"""
     params = CONFIGURATIONS.get(config)
     if not params:
         raise ValueError(f"Unknown configuration: {config}")
+    if quality not in QUALITY_PRESETS:
+        raise ValueError(f"Unknown quality: {quality}")
     
     param_list = [
-        f"-D 'Radius={radius}'",
-        f"-D 'SegAng={angle}'",
-        f"-D 'generate_track={params['generate_track']}'",
-        f"-D 'generate_ballast={params['generate_ballast']}'",
-        f"-D 'generate_ballast_buddy={params['generate_ballast_buddy']}'",
+        "-D", f"Radius={radius}",
+        "-D", f"SegAng={angle}",
+        "-D", f"generate_track={params['generate_track']}",
+        "-D", f"generate_ballast={params['generate_ballast']}",
+        "-D", f"generate_ballast_buddy={params['generate_ballast_buddy']}",
     ]
     
     # Add diverse parameter if specified
     if diverse is not None:
-        param_list.append(f"-D 'diverse={diverse}'")
+        param_list.extend(["-D", f"diverse={diverse}"])
+    
+    param_list.extend(QUALITY_PRESETS[quality])
     
-    param_str = " ".join(param_list)
-    return param_str
+    return param_list
+
+
+def meta_file_for(output_file: Path) -> Path:
+    """Return the sidecar file recording how an STL was generated"""
+    return output_file.with_name(output_file.name + ".meta")
+
+
+def file_sha1(path: Path) -> str:
+    """Return the SHA-1 hex digest of a file's contents"""
+    return hashlib.sha1(path.read_bytes()).hexdigest()
+
+
+def is_up_to_date(scad_file: Path, output_file: Path, params: List[str]) -> bool:
+    """Check whether an STL was already generated from this SCAD file with these parameters"""
+    meta_file = meta_file_for(output_file)
+    if not output_file.exists() or not meta_file.exists():
+        return False
+    
+    try:
+        meta = json.loads(meta_file.read_text())
+    except (OSError, ValueError):
+        return False
+    
+    if meta.get("params") != params:
+        return False
+    
+    # Unchanged mtime is enough; otherwise fall back to comparing contents
+    try:
+        if meta.get("scad_mtime") == scad_file.stat().st_mtime:
+            return True
+        return meta.get("scad_sha1") == file_sha1(scad_file)
+    except OSError:
+        return False
+
+
+def write_meta(scad_file: Path, output_file: Path, params: List[str]):
+    """Record the SCAD file state and parameters an STL was generated from"""
+    meta = {
+        "params": params,
+        "scad_mtime": scad_file.stat().st_mtime,
+        "scad_sha1": file_sha1(scad_file),
+    }
+    meta_file_for(output_file).write_text(json.dumps(meta, indent=2))
+
+
+def clear_meta(output_file: Path):
+    """Remove an STL's metadata so a failed render is never mistaken for up to date"""
+    try:
+        meta_file_for(output_file).unlink()
+    except FileNotFoundError:
+        pass
+
+
+def build_openscad_command(scad_file: Path, output_file: Path, params: List[str]) -> List[str]:
+    """Build the openscad argument list rendering scad_file to output_file"""
+    return [OPENSCAD_BIN, *OPENSCAD_FLAGS, *params, "-o", str(output_file), str(scad_file)]
+
+
+def begin_render(
+    scad_file: Path,
+    output_file: Path,
+    params: List[str],
+    force: bool = False
+) -> Optional[List[str]]:
+    """Return the openscad command rendering an STL, or None if it is already up to date"""
+    if not force and is_up_to_date(scad_file, output_file, params):
+        return None
+    
+    # Callers clear_meta() only when the render actually starts, so queued
+    # renders that never run keep their metadata
+    return build_openscad_command(scad_file, output_file, params)
+
+
+def finish_render(
+    scad_file: Path,
+    output_file: Path,
+    params: List[str],
+    returncode: int,
+    stderr: str
+) -> bool:
+    """Report a finished openscad run and record its metadata on success"""
+    if returncode != 0:
+        with PRINT_LOCK:
+            print(f"Error generating {output_file.name}:", file=sys.stderr)
+            print(stderr, file=sys.stderr)
+        return False
+    
+    write_meta(scad_file, output_file, params)
+    return True
 
 
 def generate_stl(
@@ -77,42 +237,52 @@ def generate_stl(
     angle: float,
     config: str,
     verbose: bool = False,
-    diverse: int = None
+    diverse: int = None,
+    force: bool = False,
+    quality: str = "final"
 ) -> bool:
     """Generate a single STL file from the OpenSCAD file"""
     
-    params = generate_scad_params(radius, angle, config, diverse)
-    
-    cmd = f"openscad {params} -o '{output_file}' '{scad_file}'"
-    
-    if verbose:
-        print(f"Generating: {output_file.name}")
-        print(f"Command: {cmd}")
+    params = generate_scad_params(radius, angle, config, diverse, quality)
     
     try:
+        cmd = begin_render(scad_file, output_file, params, force)
+        if cmd is None:
+            if verbose:
+                with PRINT_LOCK:
+                    print(f"Skipping {output_file.name} (up to date)")
+            return True
+        
+        if verbose:
+            with PRINT_LOCK:
+                print(f"Generating: {output_file.name}")
+                print(f"Command: {' '.join(cmd)}")
+        
+        clear_meta(output_file)
+        
         result = subprocess.run(
             cmd,
-            shell=True,
-            capture_output=True,
             text=True,
-            timeout=300  # 5 minute timeout per file
+            timeout=RENDER_TIMEOUT,
+            **RENDER_SPAWN_KWARGS
         )
         
-        if result.returncode != 0:
-            print(f"Error generating {output_file.name}:", file=sys.stderr)
-            print(result.stderr, file=sys.stderr)
+        if not finish_render(scad_file, output_file, params, result.returncode, result.stderr):
             return False
         
         if verbose:
-            print(f"✓ Successfully generated {output_file.name}")
+            with PRINT_LOCK:
+                print(f"✓ Successfully generated {output_file.name}")
         
         return True
     
     except subprocess.TimeoutExpired:
-        print(f"Error: Timeout generating {output_file.name}", file=sys.stderr)
+        with PRINT_LOCK:
+            print(f"Error: Timeout generating {output_file.name}", file=sys.stderr)
         return False
     except Exception as e:
-        print(f"Error generating {output_file.name}: {e}", file=sys.stderr)
+        with PRINT_LOCK:
+            print(f"Error generating {output_file.name}: {e}", file=sys.stderr)
         return False
 
 
@@ -122,28 +292,34 @@ def generate_all_configs(
     radius: int,
     angle: float,
     verbose: bool = False,
-    diverse: int = None
+    diverse: int = None,
+    jobs: int = len(CONFIGURATIONS),
+    force: bool = False,
+    quality: str = "final"
 ) -> Tuple[int, int]:
     """Generate all configuration variants for the given radius and angle"""
     
     output_dir.mkdir(parents=True, exist_ok=True)
     
-    success_count = 0
-    total_count = 0
-    
-    for config in CONFIGURATIONS.keys():
-        total_count += 1
+    def render(config: str) -> bool:
         output_file = output_dir / f"r{radius}_{config}.stl"
         
-        if generate_stl(scad_file, output_file, radius, angle, config, verbose, diverse):
-            success_count += 1
-        else:
+        if generate_stl(scad_file, output_file, radius, angle, config, verbose, diverse, force, quality):
+            return True
+        with PRINT_LOCK:
             print(f"Failed to generate {output_file.name}", file=sys.stderr)
+        return False
+    
+    # The configurations are independent renders, so run them side by side
+    workers = max(1, min(jobs, len(CONFIGURATIONS)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(render, CONFIGURATIONS))
     
-    return success_count, total_count
+    return sum(results), len(results)
 
 
-def main():
+def build_parser() -> argparse.ArgumentParser:
+    """Build the command-line parser for the generator"""
     parser = argparse.ArgumentParser(
         description="Generate STL files for OpenSCAD track curves",
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -199,13 +375,36 @@ Examples:
         default=None,
         help="Sleeper density control (higher = fewer sleepers, default: 1800)"
     )
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Maximum number of configurations to render in parallel (default: CPU count)"
+    )
+    parser.add_argument(
+        "-q", "--quality",
+        choices=list(QUALITY_PRESETS.keys()),
+        default="final",
+        help="Curve smoothness: preview and print render faster than final (default: final)"
+    )
+    parser.add_argument(
+        "-f", "--force",
+        action="store_true",
+        help="Regenerate STL files even if they are up to date"
+    )
     parser.add_argument(
         "-v", "--verbose",
         action="store_true",
         help="Verbose output"
     )
     
-    args = parser.parse_args()
+    return parser
+
+
+def main():
+    # In-process callers such as batch_generate.py skip argparse entirely and
+    # drive the render steps (begin_render/finish_render) directly
+    args = build_parser().parse_args()
     
     # Validate paths
     if not args.scad_file.exists():
@@ -235,7 +434,9 @@ Examples:
                 args.angle,
                 args.config,
                 args.verbose,
-                args.diverse
+                args.diverse,
+                args.force,
+                args.quality
             ):
                 total_success += 1
             total_generated += 1
@@ -247,7 +448,10 @@ Examples:
                 radius,
                 args.angle,
                 args.verbose,
-                args.diverse
+                args.diverse,
+                args.jobs,
+                args.force,
+                args.quality
             )
             total_success += success
             total_generated += total